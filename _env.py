@@ -0,0 +1,85 @@
+# Parsing helpers shared by the config files and smartgallery.py.
+
+import bisect
+import functools
+import ipaddress
+import os
+import types
+
+
+@functools.lru_cache(maxsize=None)
+def parse_csv(value):
+    """Split a comma-separated string into a tuple of stripped, non-empty tokens.
+
+    Memoized on the raw string, so parsing an unchanged value returns the same
+    tuple object.
+    """
+    return tuple(token for token in (part.strip() for part in value.split(',')) if token)
+
+
+def settings_from_spec(module_name, spec):
+    """Settings machinery for a config module, given its _SPEC.
+
+    spec holds (attribute, environment variable, type conversion, default)
+    entries; an environment variable, when set, takes precedence over the
+    default. Returns (get_settings, module_getattr): get_settings() reads every
+    value on first call and memoizes them as a read-only mapping, and
+    module_getattr is meant to become the module's __getattr__, so
+    `from config import PAGE_SIZE` keeps working. Names assigned directly in
+    the module are found before __getattr__ is consulted and so win.
+    """
+    @functools.lru_cache(maxsize=1)
+    def get_settings():
+        return types.MappingProxyType({attr: cast(os.environ.get(env_key, default)) for attr, env_key, cast, default in spec})
+
+    def module_getattr(name):
+        try:
+            return get_settings()[name]
+        except KeyError:
+            raise AttributeError(f"module {module_name!r} has no attribute {name!r}") from None
+
+    return get_settings, module_getattr
+
+
+def parse_bool(value):
+    return value.strip().lower() == 'true'
+
+
+def _merge_ranges(ranges):
+    starts, ends = [], []
+    for low, high in sorted(ranges):
+        if ends and low <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], high)
+        else:
+            starts.append(low)
+            ends.append(high)
+    return starts, ends
+
+
+def parse_ip_ranges(entries):
+    """Turn IP/CIDR strings into merged, sorted (starts, ends) integer bounds.
+
+    Every entry (a single IP is a /32 or /128) becomes an inclusive
+    (first_address, last_address) range; overlapping and adjacent ranges are
+    merged. Invalid entries are skipped. Returns {4: (starts, ends), 6: (starts, ends)}.
+    """
+    ranges = {4: [], 6: []}
+    for entry in entries:
+        try:
+            net = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            continue
+        ranges[net.version].append((int(net.network_address), int(net.broadcast_address)))
+    return {version: _merge_ranges(r) for version, r in ranges.items()}
+
+
+def ip_in_ranges(ranges, ip_str):
+    """Return True if ip_str falls in one of parse_ip_ranges()' ranges.
+
+    Raises ValueError on a malformed IP.
+    """
+    client_addr = ipaddress.ip_address(ip_str)
+    client_int = int(client_addr)
+    starts, ends = ranges[client_addr.version]
+    i = bisect.bisect_right(starts, client_int) - 1
+    return i >= 0 and client_int <= ends[i]
@@ -18,62 +18,79 @@
 #   not backslashes ( \ ), to ensure compatibility.
 # - It is strongly recommended to have ffmpeg installed, 
 #   since some features depend on it.
+#
+# Settings are read from the environment the first time one is accessed and then
+# memoized. smartgallery.py imports them once at startup (and derives its deletion
+# checks from them), so a changed setting takes effect after a restart.
+
+from _env import parse_bool, parse_csv, settings_from_spec
+
+
+# Every setting as (attribute, environment variable, type conversion, default).
+# Edit the defaults here; an environment variable, when set, takes precedence.
+_SPEC = (
+    # Path to the ComfyUI 'output' folder.
+    ('BASE_OUTPUT_PATH', 'GALLERY_BASE_OUTPUT_PATH', str, 'output'),
+
+    # Path to the ComfyUI 'input' folder (used for locating .json workflows).
+    ('BASE_INPUT_PATH', 'GALLERY_BASE_INPUT_PATH', str, 'input'),
+
+    # Path to the ffmpeg utility "ffprobe.exe" (Windows). 
+    # On Linux, adjust the filename accordingly. 
+    # This is required for extracting workflows from .mp4 files.  
+    # NOTE: Having a full ffmpeg installation is highly recommended.
+    ('FFPROBE_MANUAL_PATH', 'GALLERY_FFPROBE_MANUAL_PATH', str, "C:/omgp10/ffmpeg2/bin/ffprobe.exe"),
+
+    # Port on which the gallery web server will run. 
+    # Must be different from the ComfyUI port.  
+    # Note: the gallery does not require ComfyUI to be running; it works independently.
+    ('SERVER_PORT', 'GALLERY_SERVER_PORT', int, '8189'),
+
+    # Width (in pixels) of the generated thumbnails.
+    ('THUMBNAIL_WIDTH', 'GALLERY_THUMBNAIL_WIDTH', int, '300'),
+
+    # Assumed frame rate for animated WebP files.  
+    # Many tools, including ComfyUI, generate WebP animations at ~16 FPS.  
+    # Adjust this value if your WebPs use a different frame rate,  
+    # so that animation durations are calculated correctly.
+    ('WEBP_ANIMATED_FPS', 'GALLERY_WEBP_ANIMATED_FPS', float, '16.0'),
+
+    # Maximum number of files to load initially before showing a "Load more" button.  
+    # Use a very large number (e.g., 9999999) for "infinite" loading.
+    ('PAGE_SIZE', 'GALLERY_PAGE_SIZE', int, '100'),
+
+    # Names of special folders (e.g., 'video', 'audio').
+    # These folders will appear in the menu only if they exist inside BASE_OUTPUT_PATH.
+    # Leave as-is if unsure.
+    ('SPECIAL_FOLDERS', 'GALLERY_SPECIAL_FOLDERS', parse_csv, 'video,audio'),
+
+    # Deletion Control Settings
+    # Set to False to completely disable file/folder deletion for all users
+    # Set to True to enable deletion (subject to IP restrictions if configured)
+    ('ENABLE_DELETION', 'GALLERY_ENABLE_DELETION', parse_bool, 'true'),
+
+    # Comma-separated list of IP addresses and CIDR blocks that are allowed to delete files
+    # when ENABLE_DELETION is True. Examples: '192.168.1.100,10.0.0.0/8,172.16.0.0/12'
+    # Leave empty to allow deletion from any IP (when ENABLE_DELETION is True)
+    # Only takes effect when ENABLE_DELETION is True
+    ('DELETION_ALLOWED_IPS', 'GALLERY_DELETION_ALLOWED_IPS', parse_csv, '107.204.190.58'),
+
+    # --- rclone FUSE mount refresh (object-storage backends) ---
+    # When the ComfyUI 'output' folder is an rclone mount (e.g. an S3/QuObjects bucket),
+    # rclone serves a cached directory listing for its --dir-cache-time, so files uploaded
+    # straight to the bucket don't appear until that expires. Set this to rclone's
+    # remote-control API URL and the app's Refresh button will call vfs/refresh to force an
+    # immediate re-list of the viewed folder. Leave empty to disable (local disk / no rclone).
+    # Example: http://127.0.0.1:5572
+    ('RCLONE_RC_URL', 'GALLERY_RCLONE_RC_URL', lambda v: v.rstrip('/'), ''),
+
+    # --- Front-end web server file offload ---
+    # Set to true only when the gallery runs behind a server that honours the X-Sendfile
+    # header (Apache mod_xsendfile, lighttpd). Files and thumbnails are then answered with
+    # an empty response carrying the file's path, and that server streams the bytes itself.
+    # Leave false when gunicorn faces clients directly; it already uses sendfile(2).
+    ('USE_X_SENDFILE', 'GALLERY_USE_X_SENDFILE', parse_bool, 'false'),
+)
+
 
-import os
-
-# Path to the ComfyUI 'output' folder.
-BASE_OUTPUT_PATH = os.environ.get('GALLERY_BASE_OUTPUT_PATH', 'output')
-
-# Path to the ComfyUI 'input' folder (used for locating .json workflows).
-BASE_INPUT_PATH = os.environ.get('GALLERY_BASE_INPUT_PATH', 'input')
-
-# Path to the ffmpeg utility "ffprobe.exe" (Windows). 
-# On Linux, adjust the filename accordingly. 
-# This is required for extracting workflows from .mp4 files.  
-# NOTE: Having a full ffmpeg installation is highly recommended.
-FFPROBE_MANUAL_PATH = os.environ.get('GALLERY_FFPROBE_MANUAL_PATH', "C:/omgp10/ffmpeg2/bin/ffprobe.exe")
-
-# Port on which the gallery web server will run. 
-# Must be different from the ComfyUI port.  
-# Note: the gallery does not require ComfyUI to be running; it works independently.
-SERVER_PORT = int(os.environ.get('GALLERY_SERVER_PORT', '8189'))
-
-# Width (in pixels) of the generated thumbnails.
-THUMBNAIL_WIDTH = int(os.environ.get('GALLERY_THUMBNAIL_WIDTH', '300'))
-
-# Assumed frame rate for animated WebP files.  
-# Many tools, including ComfyUI, generate WebP animations at ~16 FPS.  
-# Adjust this value if your WebPs use a different frame rate,  
-# so that animation durations are calculated correctly.
-WEBP_ANIMATED_FPS = float(os.environ.get('GALLERY_WEBP_ANIMATED_FPS', '16.0'))
-
-# Maximum number of files to load initially before showing a "Load more" button.  
-# Use a very large number (e.g., 9999999) for "infinite" loading.
-PAGE_SIZE = int(os.environ.get('GALLERY_PAGE_SIZE', '100'))
-
-# Names of special folders (e.g., 'video', 'audio').
-# These folders will appear in the menu only if they exist inside BASE_OUTPUT_PATH.
-# Leave as-is if unsure.
-_special_folders_env = os.environ.get('GALLERY_SPECIAL_FOLDERS', 'video,audio')
-SPECIAL_FOLDERS = [folder.strip() for folder in _special_folders_env.split(',') if folder.strip()]
-
-# Deletion Control Settings
-# Set to False to completely disable file/folder deletion for all users
-# Set to True to enable deletion (subject to IP restrictions if configured)
-ENABLE_DELETION = os.environ.get('GALLERY_ENABLE_DELETION', 'true').lower() == 'true'
-
-# Comma-separated list of IP addresses and CIDR blocks that are allowed to delete files
-# when ENABLE_DELETION is True. Examples: '192.168.1.100,10.0.0.0/8,172.16.0.0/12'
-# Leave empty to allow deletion from any IP (when ENABLE_DELETION is True)
-# Only takes effect when ENABLE_DELETION is True
-_deletion_allowed_ips_env = os.environ.get('GALLERY_DELETION_ALLOWED_IPS', '107.204.190.58')
-DELETION_ALLOWED_IPS = [ip.strip() for ip in _deletion_allowed_ips_env.split(',') if ip.strip()]
-
-# --- rclone FUSE mount refresh (object-storage backends) ---
-# When the ComfyUI 'output' folder is an rclone mount (e.g. an S3/QuObjects bucket),
-# rclone serves a cached directory listing for its --dir-cache-time, so files uploaded
-# straight to the bucket don't appear until that expires. Set this to rclone's
-# remote-control API URL and the app's Refresh button will call vfs/refresh to force an
-# immediate re-list of the viewed folder. Leave empty to disable (local disk / no rclone).
-# Example: http://127.0.0.1:5572
-RCLONE_RC_URL = os.environ.get('GALLERY_RCLONE_RC_URL', '').rstrip('/')
\ No newline at end of file
+get_settings, __getattr__ = settings_from_spec(__name__, _SPEC)
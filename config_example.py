@@ -1,21 +1,58 @@
 # Example Smart Gallery Configuration
 # Copy this file to config.py and modify according to your needs
+#
+# Settings are read from the environment the first time one is accessed and then
+# memoized. smartgallery.py imports them once at startup (and derives its deletion
+# checks from them), so a changed setting takes effect after a restart.
 
-import os
+from _env import parse_bool, parse_csv, settings_from_spec
 
-# Basic Configuration
-BASE_OUTPUT_PATH = os.environ.get('GALLERY_BASE_OUTPUT_PATH', '/path/to/your/comfyui/output')
-BASE_INPUT_PATH = os.environ.get('GALLERY_BASE_INPUT_PATH', '/path/to/your/comfyui/input')
-FFPROBE_MANUAL_PATH = os.environ.get('GALLERY_FFPROBE_MANUAL_PATH', "/usr/bin/ffprobe")
-SERVER_PORT = int(os.environ.get('GALLERY_SERVER_PORT', '8189'))
-THUMBNAIL_WIDTH = int(os.environ.get('GALLERY_THUMBNAIL_WIDTH', '300'))
-WEBP_ANIMATED_FPS = float(os.environ.get('GALLERY_WEBP_ANIMATED_FPS', '16.0'))
-PAGE_SIZE = int(os.environ.get('GALLERY_PAGE_SIZE', '100'))
 
-_special_folders_env = os.environ.get('GALLERY_SPECIAL_FOLDERS', 'video,audio')
-SPECIAL_FOLDERS = [folder.strip() for folder in _special_folders_env.split(',') if folder.strip()]
+# Every setting as (attribute, environment variable, type conversion, default).
+# Edit the defaults here; an environment variable, when set, takes precedence.
+_SPEC = (
+    # Basic Configuration
+    ('BASE_OUTPUT_PATH', 'GALLERY_BASE_OUTPUT_PATH', str, '/path/to/your/comfyui/output'),
+    ('BASE_INPUT_PATH', 'GALLERY_BASE_INPUT_PATH', str, '/path/to/your/comfyui/input'),
+    ('FFPROBE_MANUAL_PATH', 'GALLERY_FFPROBE_MANUAL_PATH', str, "/usr/bin/ffprobe"),
+    ('SERVER_PORT', 'GALLERY_SERVER_PORT', int, '8189'),
+    ('THUMBNAIL_WIDTH', 'GALLERY_THUMBNAIL_WIDTH', int, '300'),
+    ('WEBP_ANIMATED_FPS', 'GALLERY_WEBP_ANIMATED_FPS', float, '16.0'),
+    ('PAGE_SIZE', 'GALLERY_PAGE_SIZE', int, '100'),
+
+    ('SPECIAL_FOLDERS', 'GALLERY_SPECIAL_FOLDERS', parse_csv, 'video,audio'),
+
+    # Deletion Control (using environment variables with fallbacks).
+    # To lock deletion to one machine, set the default IP below (or, preferably in prod, set
+    # GALLERY_DELETION_ALLOWED_IPS in the k8s deployment env — that overrides this default).
+    # An empty value = allow deletion from ANY IP. See also the examples at the end of this file.
+    ('ENABLE_DELETION', 'GALLERY_ENABLE_DELETION', parse_bool, 'true'),
+    ('DELETION_ALLOWED_IPS', 'GALLERY_DELETION_ALLOWED_IPS', parse_csv, '107.204.190.58'),
+
+    # --- rclone FUSE mount refresh (object-storage backends) ---
+    # When the ComfyUI 'output' folder is an rclone mount (e.g. an S3/QuObjects bucket),
+    # rclone serves a cached directory listing for its --dir-cache-time, so files uploaded
+    # straight to the bucket don't appear until that expires. Set this to rclone's
+    # remote-control API URL and the app's Refresh button will call vfs/refresh to force an
+    # immediate re-list of the viewed folder. Leave empty to disable (local disk / no rclone).
+    # Example: http://127.0.0.1:5572
+    ('RCLONE_RC_URL', 'GALLERY_RCLONE_RC_URL', lambda v: v.rstrip('/'), ''),
+
+    # --- Front-end web server file offload ---
+    # Set to true only when the gallery runs behind a server that honours the X-Sendfile
+    # header (Apache mod_xsendfile, lighttpd). Files and thumbnails are then answered with
+    # an empty response carrying the file's path, and that server streams the bytes itself.
+    # Leave false when gunicorn faces clients directly; it already uses sendfile(2).
+    ('USE_X_SENDFILE', 'GALLERY_USE_X_SENDFILE', parse_bool, 'false'),
+)
+
+
+get_settings, __getattr__ = settings_from_spec(__name__, _SPEC)
+
 
 # Deletion Control Examples:
+# Uncommenting one of these pairs fixes the setting in this file: a name assigned here
+# takes precedence over its _SPEC entry, and the GALLERY_* environment variable is ignored.
 
 # Example 1: Completely disable deletion for everyone
 # ENABLE_DELETION = False
@@ -26,9 +63,6 @@ SPECIAL_FOLDERS = [folder.strip() for folder in _special_folders_env.split(',')
 # DELETION_ALLOWED_IPS = []
 
 # Example 3: Only allow deletion from specific IP addresses
-# NOTE: these example lines are ILLUSTRATIVE ONLY. The active configuration is the
-# env-driven block further down ("Current settings"), which reassigns these variables.
-# Setting a value here has NO effect — set it on the env-default line below instead.
 # ENABLE_DELETION = True
 # DELETION_ALLOWED_IPS = ['107.204.190.58']
 
@@ -39,20 +73,3 @@ SPECIAL_FOLDERS = [folder.strip() for folder in _special_folders_env.split(',')
 # Example 5: Mixed IP addresses and CIDR blocks
 # ENABLE_DELETION = True
 # DELETION_ALLOWED_IPS = ['192.168.1.100', '10.0.0.0/8', '172.16.0.0/12', '127.0.0.1']
-
-# Current settings (using environment variables with fallbacks).
-# THIS block is what actually takes effect at runtime. To lock deletion to one machine,
-# set the default IP below (or, preferably in prod, set GALLERY_DELETION_ALLOWED_IPS in the
-# k8s deployment env — that overrides this default). An empty value = allow deletion from ANY IP.
-ENABLE_DELETION = os.environ.get('GALLERY_ENABLE_DELETION', 'true').lower() == 'true'
-_deletion_allowed_ips_env = os.environ.get('GALLERY_DELETION_ALLOWED_IPS', '107.204.190.58')
-DELETION_ALLOWED_IPS = [ip.strip() for ip in _deletion_allowed_ips_env.split(',') if ip.strip()]
-
-# --- rclone FUSE mount refresh (object-storage backends) ---
-# When the ComfyUI 'output' folder is an rclone mount (e.g. an S3/QuObjects bucket),
-# rclone serves a cached directory listing for its --dir-cache-time, so files uploaded
-# straight to the bucket don't appear until that expires. Set this to rclone's
-# remote-control API URL and the app's Refresh button will call vfs/refresh to force an
-# immediate re-list of the viewed folder. Leave empty to disable (local disk / no rclone).
-# Example: http://127.0.0.1:5572
-RCLONE_RC_URL = os.environ.get('GALLERY_RCLONE_RC_URL', '').rstrip('/')
\ No newline at end of file
@@ -9,23 +9,34 @@
 
 import os
 import hashlib
+import mmap
 import cv2
 import json
+import orjson
 import shutil
+import errno
 import re
 import sqlite3
+import atexit
+import weakref
+import contextlib
 import time
-import glob
 import sys
+import threading
+import multiprocessing
 import subprocess
 import base64
-import ipaddress
 import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from flask import Flask, render_template, send_from_directory, abort, send_file, url_for, redirect, request, jsonify, Response
+from flask.json.provider import JSONProvider
 from PIL import Image, ImageSequence
 import colorsys
+import functools
+import bisect
 
 # Import user configuration
+import config
 from config import (
     BASE_OUTPUT_PATH,
     BASE_INPUT_PATH,
@@ -39,6 +50,9 @@ from config import (
     DELETION_ALLOWED_IPS,
     RCLONE_RC_URL
 )
+from _env import parse_ip_ranges, ip_in_ranges
+# Newer settings; a config.py written before they existed keeps working without them.
+USE_X_SENDFILE = getattr(config, 'USE_X_SENDFILE', False)
 
 # --- CACHE AND FOLDER NAMES ---
 THUMBNAIL_CACHE_FOLDER_NAME = '.thumbnails_cache'
@@ -47,6 +61,16 @@ DATABASE_FILENAME = 'gallery_cache.sqlite'
 WORKFLOW_FOLDER_NAME = 'workflow_logs_success'
 
 # --- HELPER FUNCTIONS (DEFINED FIRST) ---
+def json_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # orjson rejects the NaN/Infinity literals Python's json module writes
+        return json.loads(data)
+
+def json_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
 def path_to_key(relative_path):
     if not relative_path: return '_root_'
     return base64.urlsafe_b64encode(relative_path.replace(os.sep, '/').encode()).decode()
@@ -57,10 +81,27 @@ def key_to_path(key):
         return base64.urlsafe_b64decode(key.encode()).decode().replace('/', os.sep)
     except Exception: return None
 
+def file_id_for(path):
+    """Stable DB id for a file path."""
+    return hashlib.blake2s(path.encode(), digest_size=16).hexdigest()
+
+def thumbnail_path_for(file_hash):
+    return os.path.join(THUMBNAIL_CACHE_DIR, file_hash + THUMBNAIL_EXT)
+
+def thumbnail_hash_for(path, mtime):
+    """Thumbnail cache key; changes whenever the file is modified."""
+    return hashlib.blake2s((path + str(mtime)).encode(), digest_size=16).hexdigest()
+
+# DELETION_ALLOWED_IPS as merged integer ranges, built once from whatever list config
+# defines, so the per-request check only bisects.
+DELETION_IP_RANGES = parse_ip_ranges(DELETION_ALLOWED_IPS)
+
+@functools.lru_cache(maxsize=1024)
 def is_deletion_allowed(client_ip):
     """
     Check if deletion is allowed based on configuration and client IP.
     Returns (allowed: bool, reason: str)
+    Memoized per IP: the settings are read once at import and don't change at runtime.
     """
     if not ENABLE_DELETION:
         return False, "Deletion is disabled in configuration"
@@ -69,23 +110,10 @@ def is_deletion_allowed(client_ip):
     if not DELETION_ALLOWED_IPS:
         return True, "Deletion allowed"
     
-    # Check if client IP is in allowed list
+    # Check if client IP is in allowed list (pre-parsed into DELETION_IP_RANGES)
     try:
-        client_addr = ipaddress.ip_address(client_ip)
-        for allowed_ip in DELETION_ALLOWED_IPS:
-            try:
-                # Check if it's a CIDR block or single IP
-                if '/' in allowed_ip:
-                    # CIDR block
-                    if client_addr in ipaddress.ip_network(allowed_ip, strict=False):
-                        return True, "IP allowed by CIDR rule"
-                else:
-                    # Single IP
-                    if client_addr == ipaddress.ip_address(allowed_ip):
-                        return True, "IP explicitly allowed"
-            except ValueError:
-                # Invalid IP format in configuration, skip it
-                continue
+        if ip_in_ranges(DELETION_IP_RANGES, client_ip):
+            return True, "IP in allowed list"
         return False, f"IP {client_ip} not in allowed list"
     except ValueError:
         return False, f"Invalid client IP format: {client_ip}"
@@ -118,7 +146,7 @@ def get_client_ip():
     return remote_addr
 
 # --- DERIVED SETTINGS ---
-DB_SCHEMA_VERSION = 21
+DB_SCHEMA_VERSION = 25
 BASE_INPUT_PATH_WORKFLOW = os.path.join(BASE_INPUT_PATH, WORKFLOW_FOLDER_NAME)
 # Cache (thumbnails + SQLite index) may live somewhere other than BASE_OUTPUT_PATH.
 # In containerized / remote-storage setups, point GALLERY_CACHE_DIR at a fast LOCAL
@@ -126,15 +154,27 @@ BASE_INPUT_PATH_WORKFLOW = os.path.join(BASE_INPUT_PATH, WORKFLOW_FOLDER_NAME)
 # (e.g. S3-FUSE) mount, where SQLite can corrupt and dir-walks are slow.
 _CACHE_BASE = os.environ.get('GALLERY_CACHE_DIR', BASE_OUTPUT_PATH)
 THUMBNAIL_CACHE_DIR = os.path.join(_CACHE_BASE, THUMBNAIL_CACHE_FOLDER_NAME)
+THUMBNAIL_EXT = '.webp'  # all thumbnails, still or animated, are WebP
 SQLITE_CACHE_DIR = os.path.join(_CACHE_BASE, SQLITE_CACHE_FOLDER_NAME)
 DATABASE_FILE = os.path.join(SQLITE_CACHE_DIR, DATABASE_FILENAME)
 PROTECTED_FOLDER_KEYS = {path_to_key(f) for f in SPECIAL_FOLDERS}
 PROTECTED_FOLDER_KEYS.add('_root_')
 
 # --- FLASK APP INITIALIZATION ---
+class OrjsonProvider(JSONProvider):
+    """Serve jsonify() responses and the |tojson template filter through orjson."""
+    def dumps(self, obj, **kwargs):
+        return json_dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
 app = Flask(__name__)
-gallery_view_cache = []
-folder_config_cache = None
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
+app.json = OrjsonProvider(app)
+folder_config_cache = None  # (version token it was built for, folder tree)
+folder_config_version = object()  # replaced by invalidate_folder_config()
+folder_config_lock = threading.Lock()
 
 
 @app.route('/healthz')
@@ -155,6 +195,8 @@ NODE_CATEGORIES = {
     "VAEEncode": "processing", "LatentUpscale": "processing", "ConditioningCombine": "processing",
     "PreviewImage": "output", "SaveImage": "output"
 }
+# Posizione di ogni categoria in NODE_CATEGORIES_ORDER, per ordinare senza list.index()
+_CATEGORY_RANK = {category: rank for rank, category in enumerate(NODE_CATEGORIES_ORDER)}
 NODE_PARAM_NAMES = {
     "CLIPTextEncode": ["text"],
     "KSampler": ["seed", "steps", "cfg", "sampler_name", "scheduler", "denoise"],
@@ -168,16 +210,15 @@ NODE_PARAM_NAMES = {
 }
 
 # Cache per i colori dei nodi
-_node_colors_cache = {}
-
+@functools.lru_cache(maxsize=512)
 def get_node_color(node_type):
     """Genera un colore univoco e consistente per un tipo di nodo."""
-    if node_type not in _node_colors_cache:
-        # Usa un hash per ottenere un colore consistente per lo stesso tipo di nodo
-        hue = (hash(node_type + "a_salt_string") % 360) / 360.0
-        rgb = [int(c * 255) for c in colorsys.hsv_to_rgb(hue, 0.7, 0.85)]
-        _node_colors_cache[node_type] = f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
-    return _node_colors_cache[node_type]
+    # blake2s invece di hash(): hash() delle stringhe cambia a ogni avvio (PYTHONHASHSEED),
+    # quindi i colori cambiavano tra un riavvio e l'altro e tra i worker
+    digest = hashlib.blake2s(node_type.encode(), digest_size=2).digest()
+    hue = (int.from_bytes(digest, 'big') % 360) / 360.0
+    rgb = [int(c * 255) for c in colorsys.hsv_to_rgb(hue, 0.7, 0.85)]
+    return f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
 
 def filter_enabled_nodes(workflow_data):
     """Filtra e restituisce solo i nodi e i link attivi (mode=0) da un workflow."""
@@ -198,7 +239,7 @@ def generate_node_summary(workflow_json_string):
     in un formato strutturato (lista di dizionari).
     """
     try:
-        workflow_data = json.loads(workflow_json_string)
+        workflow_data = json_loads(workflow_json_string)
     except json.JSONDecodeError:
         return None # Errore di parsing
 
@@ -209,7 +250,7 @@ def generate_node_summary(workflow_json_string):
 
     # Ordina i nodi per categoria logica e poi per ID
     sorted_nodes = sorted(nodes, key=lambda n: (
-        NODE_CATEGORIES_ORDER.index(NODE_CATEGORIES.get(n.get('type'), 'others')),
+        _CATEGORY_RANK[NODE_CATEGORIES.get(n.get('type'), 'others')],
         n.get('id', 0)
     ))
     
@@ -239,6 +280,51 @@ def generate_node_summary(workflow_json_string):
 
 # --- ALL UTILITY AND HELPER FUNCTIONS ARE DEFINED HERE, BEFORE ANY ROUTES ---
 
+# Deleted folders are removed by a background thread; the folder scan skips them and
+# their names can't be reused until the removal finishes.
+_background_io = ThreadPoolExecutor(max_workers=2, thread_name_prefix='gallery-io')
+_pending_removals = set()  # normalized paths still being deleted by _background_io
+_pending_removals_lock = threading.Lock()
+
+def _normalized_folder_path(path):
+    # Same form as the folder tree's 'path' entries.
+    return os.path.normpath(path).replace('\\', '/')
+
+def _remove_tree(path):
+    try:
+        shutil.rmtree(path)
+    except Exception as e:
+        print(f"ERROR: Could not remove '{path}': {e}")
+    finally:
+        with _pending_removals_lock: _pending_removals.discard(_normalized_folder_path(path))
+
+def remove_tree_in_background(path):
+    """Delete a folder without making the request wait for every file on the WAN mount.
+    Until the delete finishes the folder is left out of the folder tree and its name
+    can't be reused (see removal_pending)."""
+    with _pending_removals_lock: _pending_removals.add(_normalized_folder_path(path))
+    _background_io.submit(_remove_tree, path)
+
+def removal_pending(path):
+    """True while remove_tree_in_background() is still deleting `path`."""
+    with _pending_removals_lock: return _normalized_folder_path(path) in _pending_removals
+
+_UNSAFE_FOLDER_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_-]')
+
+def safe_folder_name(name):
+    """Keep only ASCII letters, digits, '_' and '-' in a user-supplied folder name."""
+    return _UNSAFE_FOLDER_NAME_CHARS.sub('', name)
+
+def move_path(src, dst):
+    """Move a file or folder with a plain rename; copy+delete only across filesystems.
+    shutil.move stats the destination before renaming, which costs a round trip per
+    file on the WAN mount. Callers check that dst doesn't exist."""
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+        shutil.move(src, dst)
+
 def find_ffprobe_path():
     if FFPROBE_MANUAL_PATH and os.path.isfile(FFPROBE_MANUAL_PATH):
         try:
@@ -255,102 +341,103 @@ def find_ffprobe_path():
 
 def _validate_and_get_workflow(json_string):
     try:
-        data = json.loads(json_string)
+        data = json_loads(json_string)
         
         # First check for standard workflow format (has 'nodes' key)
         workflow_data = data.get('workflow', data.get('prompt', data))
         if isinstance(workflow_data, dict) and 'nodes' in workflow_data: 
-            return json.dumps(workflow_data)
+            # Already a workflow: serve the original text, not a re-encoding of it.
+            if workflow_data is data: return json_string
+            # Anything re-encoded goes through the stdlib parser and writer, which keep
+            # NaN/Infinity and integers beyond 64 bits exactly (orjson turns them into
+            # null or floats, or fails outright).
+            data = json.loads(json_string)
+            return json.dumps(data.get('workflow', data.get('prompt', data)))
         
         # Check if we have ComfyUI prompt format (numbered keys with node definitions)
-        if isinstance(data, dict):
-            # Check if it looks like a ComfyUI prompt structure (numbered keys)
-            numbered_keys = [k for k in data.keys() if k.isdigit()]
-            if numbered_keys:
-                # Convert ComfyUI prompt format to workflow format
-                nodes = []
-                for node_id in numbered_keys:
-                    node_data = data[node_id]
-                    if isinstance(node_data, dict) and 'class_type' in node_data:
-                        # Convert prompt node to workflow node format
-                        workflow_node = {
-                            'id': int(node_id),
-                            'type': node_data['class_type'],
-                            'pos': [0, 0],  # Default position
-                            'size': {'0': 210, '1': 46},  # Default size
-                            'flags': {},
-                            'order': int(node_id),
-                            'mode': 0,
-                            'inputs': [],
-                            'outputs': [],
-                            'properties': {},
-                        }
-                        
-                        # Extract widgets_values from inputs if available
-                        inputs = node_data.get('inputs', {})
-                        if inputs:
-                            # Convert inputs dict to widgets_values list for compatibility
-                            widgets_values = []
-                            for key, value in inputs.items():
-                                if not isinstance(value, list):  # Skip connection references
-                                    widgets_values.append(value)
-                            if widgets_values:
-                                workflow_node['widgets_values'] = widgets_values
-                        
-                        nodes.append(workflow_node)
-                
-                if nodes:
-                    converted_workflow = {
-                        'nodes': nodes,
-                        'links': [],  # We don't have link info in prompt format
-                        'groups': [],
-                        'config': {},
-                        'extra': {},
-                        'version': 0.4
-                    }
-                    return json.dumps(converted_workflow)
+        if isinstance(data, dict) and any(isinstance(node_data, dict) and 'class_type' in node_data for node_data in data.values()):
+            data = json.loads(json_string)  # exact values for the conversion, as above
+            # Check if it looks like a ComfyUI prompt structure (numbered keys) and
+            # convert it to workflow format in a single pass over the items
+            nodes = []
+            for node_id, node_data in data.items():
+                if not (node_id.isdigit() and isinstance(node_data, dict) and 'class_type' in node_data):
+                    continue
+                node_num = int(node_id)
+                # Convert prompt node to workflow node format
+                workflow_node = {
+                    'id': node_num,
+                    'type': node_data['class_type'],
+                    'pos': [0, 0],  # Default position
+                    'size': {'0': 210, '1': 46},  # Default size
+                    'flags': {},
+                    'order': node_num,
+                    'mode': 0,
+                    'inputs': [],
+                    'outputs': [],
+                    'properties': {},
+                }
+                # Convert inputs dict to widgets_values list for compatibility,
+                # skipping connection references ([node_id, slot] lists)
+                widgets_values = [v for v in (node_data.get('inputs') or {}).values() if not isinstance(v, list)]
+                if widgets_values:
+                    workflow_node['widgets_values'] = widgets_values
+                nodes.append(workflow_node)
+
+            if nodes:
+                converted_workflow = {
+                    'nodes': nodes,
+                    'links': [],  # We don't have link info in prompt format
+                    'groups': [],
+                    'config': {},
+                    'extra': {},
+                    'version': 0.4
+                }
+                return json.dumps(converted_workflow)
         
     except Exception: 
         pass
     return None
 
+_JSON_DECODER = json.JSONDecoder()
+_BRACE_RE = re.compile(r'\{')
+
 def _scan_bytes_for_workflow(content_bytes):
-    open_braces, start_index = 0, -1
-    try:
-        stream_str = content_bytes.decode('utf-8', errors='ignore')
-        first_brace = stream_str.find('{')
-        if first_brace == -1: return None
-        stream_subset = stream_str[first_brace:]
-        for i, char in enumerate(stream_subset):
-            if char == '{':
-                if start_index == -1: start_index = i
-                open_braces += 1
-            elif char == '}':
-                if start_index != -1: open_braces -= 1
-            if start_index != -1 and open_braces == 0:
-                candidate = stream_subset[start_index : i + 1]
-                json.loads(candidate)
-                return candidate
-    except Exception:
-        return None
+    # Try each '{' in turn (found by the C regex engine) and let the C JSON scanner find
+    # where that object ends: raw_decode stops at the closing brace and ignores trailing
+    # bytes. A stray brace in binary data before the real JSON no longer hides it.
+    if b'{' not in content_bytes: return None
+    stream_str = content_bytes.decode('utf-8', errors='ignore')
+    for match in _BRACE_RE.finditer(stream_str):
+        try:
+            _, end = _JSON_DECODER.raw_decode(stream_str, match.start())
+            return stream_str[match.start():end]
+        except ValueError:
+            continue
     return None
 
-def extract_workflow(filepath):
+def probe_video(filepath):
+    """One ffprobe run for both the container tags (workflow) and the streams (size, length).
+    Returns the parsed JSON, or None without ffprobe or on failure."""
+    if not FFPROBE_EXECUTABLE_PATH: return None
+    try:
+        cmd = [FFPROBE_EXECUTABLE_PATH, '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', filepath]
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0)
+        return json_loads(result.stdout)
+    except Exception: return None
+
+def extract_workflow(filepath, probe=None):
+    """probe: probe_video() output the caller already has, so videos aren't probed twice."""
     ext = os.path.splitext(filepath)[1].lower()
     video_exts = ['.mp4', '.mkv', '.webm', '.mov', '.avi']
     
     if ext in video_exts:
-        if FFPROBE_EXECUTABLE_PATH:
-            try:
-                cmd = [FFPROBE_EXECUTABLE_PATH, '-v', 'quiet', '-print_format', 'json', '-show_format', filepath]
-                result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0)
-                data = json.loads(result.stdout)
-                if 'format' in data and 'tags' in data['format']:
-                    for value in data['format']['tags'].values():
-                        if isinstance(value, str) and value.strip().startswith('{'):
-                            workflow = _validate_and_get_workflow(value)
-                            if workflow: return workflow
-            except Exception: pass
+        data = probe if probe is not None else probe_video(filepath)
+        if data and 'format' in data and 'tags' in data['format']:
+            for value in data['format']['tags'].values():
+                if isinstance(value, str) and value.strip().startswith('{'):
+                    workflow = _validate_and_get_workflow(value)
+                    if workflow: return workflow
     else:
         try:
             with Image.open(filepath) as img:
@@ -376,11 +463,10 @@ def extract_workflow(filepath):
     except Exception: pass
 
     try:
-        base_filename = os.path.basename(filepath)
-        search_pattern = os.path.join(BASE_INPUT_PATH_WORKFLOW, f"{base_filename}*.json")
-        json_files = glob.glob(search_pattern)
-        if json_files:
-            latest = max(json_files, key=os.path.getmtime)
+        # The newest "<file name>*.json" log wins. Unlike a glob pattern, a prefix match
+        # isn't thrown off by '[' or '*' in the file name.
+        latest = latest_workflow_log(os.path.basename(filepath))
+        if latest:
             with open(latest, 'r', encoding='utf-8') as f:
                 workflow = _validate_and_get_workflow(f.read())
                 if workflow: return workflow
@@ -388,29 +474,137 @@ def extract_workflow(filepath):
                 
     return None
 
-def is_webp_animated(filepath):
+# (directory mtime, build time, sorted log names, [(path, mtime)] in the same order). Rebuilt
+# when the workflow folder's own mtime changes, i.e. when a log is added, removed or
+# renamed, so a sync looks up thousands of files against one listing instead of one
+# listing each. On s3fs/rclone mounts an upload straight to the bucket doesn't touch the
+# directory's mtime, so the listing is also rebuilt once it is WORKFLOW_LOG_LISTING_TTL_SEC old.
+WORKFLOW_LOG_LISTING_TTL_SEC = 30
+_workflow_log_listing = (None, 0.0, [], [])
+
+def latest_workflow_log(base_filename):
+    """Path of the newest BASE_INPUT_PATH_WORKFLOW/<base_filename>*.json, or None."""
+    global _workflow_log_listing
     try:
-        with Image.open(filepath) as img: return getattr(img, 'is_animated', False)
-    except: return False
+        dir_mtime = os.stat(BASE_INPUT_PATH_WORKFLOW).st_mtime_ns
+    except OSError:
+        return None
+    listing = _workflow_log_listing
+    now = time.monotonic()
+    if listing[0] != dir_mtime or now - listing[1] > WORKFLOW_LOG_LISTING_TTL_SEC:
+        with os.scandir(BASE_INPUT_PATH_WORKFLOW) as it:
+            entries = sorted((entry.name, entry.path, entry.stat().st_mtime) for entry in it if entry.name.endswith('.json') and entry.is_file())
+        listing = _workflow_log_listing = (dir_mtime, now, [name for name, _, _ in entries], [(path, mtime) for _, path, mtime in entries])
+    _, _, names, logs = listing
+    # Names sharing the prefix are contiguous in sorted order.
+    start = end = bisect.bisect_left(names, base_filename)
+    while end < len(names) and names[end].startswith(base_filename): end += 1
+    return max(logs[start:end], key=lambda log: log[1], default=(None,))[0]
+
+# Byte strings only a workflow ('nodes') or an API prompt ('class_type') carries.
+_WORKFLOW_MARKERS = (b'"nodes"', b'"class_type"')
+
+def probe_workflow(filepath, img=None, probe=None):
+    """Cheap has_workflow test used while indexing: checks where extract_workflow() finds a
+    workflow without decoding any JSON. img: the file already opened by the caller; probe:
+    its probe_video() output. The full extraction runs only on download or node summary."""
+    if probe is not None:
+        tags = probe.get('format', {}).get('tags', {})
+        if any(isinstance(value, str) and value.lstrip().startswith('{') for value in tags.values()): return True
+    elif img is not None:
+        if 'workflow' in img.info or 'prompt' in img.info: return True
+        exif_data = img.info.get('exif')
+        if isinstance(exif_data, bytes) and any(marker in exif_data for marker in _WORKFLOW_MARKERS): return True
+    else:
+        # Nothing parsed the metadata (audio, other types, videos without ffprobe): look for
+        # the markers in the raw bytes like extract_workflow()'s file scan, minus the decode.
+        # mmap lets the C search run over a large video without reading it into memory.
+        try:
+            with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                if any(content.find(marker) != -1 for marker in _WORKFLOW_MARKERS): return True
+        except (OSError, ValueError): pass  # ValueError: empty file, nothing to map
+    try:
+        return latest_workflow_log(os.path.basename(filepath)) is not None
+    except OSError:
+        return False
+
+class _NoWorkflow(Exception):
+    pass
+
+@functools.lru_cache(maxsize=256)
+def _extract_workflow_memoized(filepath, mtime):
+    # Raising instead of returning None keeps misses out of the cache (lru_cache doesn't
+    # store exceptions): a workflow log written after a first look is still found.
+    workflow = extract_workflow(filepath)
+    if workflow is None: raise _NoWorkflow
+    return workflow
+
+def extract_workflow_cached(filepath, mtime):
+    """extract_workflow() memoized on (path, mtime): repeat downloads and node summaries of
+    an unchanged file skip the read and parse. mtime is only part of the key; only found
+    workflows are cached."""
+    try: return _extract_workflow_memoized(filepath, mtime)
+    except _NoWorkflow: return None
 
 def format_duration(seconds):
     if not seconds or seconds < 0: return ""
     m, s = divmod(int(seconds), 60); h, m = divmod(m, 60)
     return f"{h}:{m:02d}:{s:02d}" if h > 0 else f"{m:02d}:{s:02d}"
 
-def analyze_file_metadata(filepath):
-    details = {'type': 'unknown', 'duration': '', 'dimensions': '', 'has_workflow': 0}
-    ext_lower = os.path.splitext(filepath)[1].lower()
-    type_map = {'.png': 'image', '.jpg': 'image', '.jpeg': 'image', '.gif': 'animated_image', '.mp4': 'video', '.webm': 'video', '.mov': 'video', '.mp3': 'audio', '.wav': 'audio', '.ogg': 'audio', '.flac': 'audio'}
-    details['type'] = type_map.get(ext_lower, 'unknown')
-    if details['type'] == 'unknown' and ext_lower == '.webp': details['type'] = 'animated_image' if is_webp_animated(filepath) else 'image'
-    if 'image' in details['type']:
-        try:
-            with Image.open(filepath) as img: details['dimensions'] = f"{img.width}x{img.height}"
-        except Exception: pass
-    if extract_workflow(filepath): details['has_workflow'] = 1
+# One analyzer per extension, chosen with a single dict lookup in analyze_file_metadata.
+# Each returns the details dict; key order matters, _process_file unpacks its values.
+def _new_details(file_type):
+    return {'type': file_type, 'duration': '', 'dimensions': '', 'has_workflow': 0}
+
+def _analyze_image(filepath):
+    details = _new_details('image')
+    try:
+        with Image.open(filepath) as img:
+            details['dimensions'] = f"{img.width}x{img.height}"
+            details['has_workflow'] = int(probe_workflow(filepath, img))
+    except Exception:
+        details['has_workflow'] = int(probe_workflow(filepath))
+    return details
+
+def _analyze_gif(filepath):
+    details = _new_details('animated_image')
+    try:
+        with Image.open(filepath) as img:
+            details['dimensions'] = f"{img.width}x{img.height}"
+            details['has_workflow'] = int(probe_workflow(filepath, img))
+            if getattr(img, 'is_animated', False):
+                details['duration'] = format_duration(sum(frame.info.get('duration', 100) for frame in ImageSequence.Iterator(img)) / 1000)
+    except Exception:
+        if not details['has_workflow']: details['has_workflow'] = int(probe_workflow(filepath))
+    return details
+
+def _analyze_webp(filepath):
+    # WebP may be a still image or an animation; one open answers both and gives the size.
+    details = _new_details('image')
+    try:
+        with Image.open(filepath) as img:
+            details['dimensions'] = f"{img.width}x{img.height}"
+            details['has_workflow'] = int(probe_workflow(filepath, img))
+            if getattr(img, 'is_animated', False):
+                details['type'] = 'animated_image'
+                details['duration'] = format_duration(getattr(img, 'n_frames', 1) / WEBP_ANIMATED_FPS)
+    except Exception:
+        if not details['has_workflow']: details['has_workflow'] = int(probe_workflow(filepath))
+    return details
+
+def _analyze_video(filepath):
+    details = _new_details('video')
+    probe = probe_video(filepath)
+    details['has_workflow'] = int(probe_workflow(filepath, probe=probe))
+    video_stream = next((st for st in probe.get('streams', []) if st.get('codec_type') == 'video'), None) if probe else None
     total_duration_sec = 0
-    if details['type'] == 'video':
+    if video_stream:
+        try:
+            total_duration_sec = float(probe.get('format', {}).get('duration') or video_stream.get('duration') or 0)
+            details['dimensions'] = f"{int(video_stream['width'])}x{int(video_stream['height'])}"
+        except (KeyError, TypeError, ValueError): pass
+    else:
+        # No ffprobe: fall back to opening the container with OpenCV.
         try:
             cap = cv2.VideoCapture(filepath)
             if cap.isOpened():
@@ -419,33 +613,50 @@ def analyze_file_metadata(filepath):
                 details['dimensions'] = f"{int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}"
                 cap.release()
         except Exception: pass
-    elif details['type'] == 'animated_image':
-        try:
-            with Image.open(filepath) as img:
-                if getattr(img, 'is_animated', False):
-                    if ext_lower == '.gif': total_duration_sec = sum(frame.info.get('duration', 100) for frame in ImageSequence.Iterator(img)) / 1000
-                    elif ext_lower == '.webp': total_duration_sec = getattr(img, 'n_frames', 1) / WEBP_ANIMATED_FPS
-        except Exception: pass
-    if total_duration_sec > 0: details['duration'] = format_duration(total_duration_sec)
+    details['duration'] = format_duration(total_duration_sec)
     return details
 
+def _analyzer_without_media_info(file_type):
+    def analyze(filepath):
+        details = _new_details(file_type)
+        details['has_workflow'] = int(probe_workflow(filepath))
+        return details
+    return analyze
+
+_analyze_audio = _analyzer_without_media_info('audio')
+_analyze_unknown = _analyzer_without_media_info('unknown')
+
+_ANALYZERS = {
+    '.png': _analyze_image, '.jpg': _analyze_image, '.jpeg': _analyze_image,
+    '.gif': _analyze_gif, '.webp': _analyze_webp,
+    '.mp4': _analyze_video, '.webm': _analyze_video, '.mov': _analyze_video,
+    '.mp3': _analyze_audio, '.wav': _analyze_audio, '.ogg': _analyze_audio, '.flac': _analyze_audio,
+}
+
+def analyze_file_metadata(filepath):
+    return _ANALYZERS.get(os.path.splitext(filepath)[1].lower(), _analyze_unknown)(filepath)
+
 def create_thumbnail(filepath, file_hash, file_type):
     if file_type in ['image', 'animated_image']:
         try:
             with Image.open(filepath) as img:
-                fmt = 'gif' if img.format == 'GIF' else 'webp' if img.format == 'WEBP' else 'jpeg'
-                cache_path = os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash}.{fmt}")
+                cache_path = thumbnail_path_for(file_hash)
                 if file_type == 'animated_image' and getattr(img, 'is_animated', False):
-                    frames = [fr.copy() for fr in ImageSequence.Iterator(img)]
-                    if frames:
-                        for frame in frames: frame.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.Resampling.LANCZOS)
-                        processed_frames = [frame.convert('RGBA').convert('RGB') for frame in frames]
-                        if processed_frames:
-                            processed_frames[0].save(cache_path, save_all=True, append_images=processed_frames[1:], duration=img.info.get('duration', 100), loop=img.info.get('loop', 0), optimize=True)
+                    # Shrink each frame as it is decoded: only one full-size frame is in
+                    # memory at a time instead of the whole animation.
+                    processed_frames = []
+                    for frame in ImageSequence.Iterator(img):
+                        frame = frame.copy()
+                        frame.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.Resampling.LANCZOS)
+                        processed_frames.append(frame.convert('RGBA').convert('RGB'))
+                    if processed_frames:
+                        processed_frames[0].save(cache_path, 'WEBP', save_all=True, append_images=processed_frames[1:], duration=img.info.get('duration', 100), loop=img.info.get('loop', 0), quality=70, method=4)
                 else:
+                    # thumbnail() asks the decoder for a reduced draft first (JPEG decodes
+                    # at 1/2-1/8 scale) and box-reduces before the LANCZOS pass.
                     img.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.Resampling.LANCZOS)
                     if img.mode != 'RGB': img = img.convert('RGB')
-                    img.save(cache_path, 'JPEG', quality=85)
+                    img.save(cache_path, 'WEBP', quality=80, method=4)
                 return cache_path
         except Exception as e: print(f"ERROR (Pillow): Could not create thumbnail for {os.path.basename(filepath)}: {e}")
     elif file_type == 'video':
@@ -454,40 +665,200 @@ def create_thumbnail(filepath, file_hash, file_type):
             success, frame = cap.read()
             cap.release()
             if success:
-                cache_path = os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash}.jpeg")
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                img = Image.fromarray(frame_rgb)
-                img.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.Resampling.LANCZOS)
-                img.save(cache_path, 'JPEG', quality=80)
+                cache_path = thumbnail_path_for(file_hash)
+                # Shrink in OpenCV first (INTER_AREA is its downscaling filter) so the colour
+                # conversion and the copy into Pillow touch a thumbnail, not a 4K frame.
+                height, width = frame.shape[:2]
+                scale = min(THUMBNAIL_WIDTH / width, THUMBNAIL_WIDTH * 2 / height)
+                if scale < 1:
+                    frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+                img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                img.save(cache_path, 'WEBP', quality=80, method=4)
                 return cache_path
         except Exception as e: print(f"ERROR (OpenCV): Could not create thumbnail for {os.path.basename(filepath)}: {e}")
     return None
 
+# Below this many files the pool start-up costs more than it saves.
+PARALLEL_ANALYSIS_MIN_FILES = 16
+ANALYSIS_IO_THREADS = 8
+ANALYSIS_MAX_PROCESSES = 8  # each worker loads its own Pillow/OpenCV
+
+def analysis_process_count():
+    """CPUs this process may actually run on (a container's cpuset, not the node's
+    os.cpu_count()), capped at ANALYSIS_MAX_PROCESSES."""
+    try: cpus = len(os.sched_getaffinity(0))
+    except AttributeError: cpus = os.cpu_count() or 1  # no sched_getaffinity on Windows/macOS
+    return min(cpus, ANALYSIS_MAX_PROCESSES)
+
+def _init_analysis_worker(ffprobe_path):
+    # Worker processes are started with 'spawn', so they don't inherit the global.
+    global FFPROBE_EXECUTABLE_PATH
+    FFPROBE_EXECUTABLE_PATH = ffprobe_path
+
+def existing_thumbnail_hashes():
+    """Hashes of every cached thumbnail, from a single directory read."""
+    try:
+        with os.scandir(THUMBNAIL_CACHE_DIR) as it:
+            # Thumbnails cached before the switch to WebP don't count; they get regenerated.
+            return {entry.name[:-len(THUMBNAIL_EXT)] for entry in it if entry.name.endswith(THUMBNAIL_EXT)}
+    except FileNotFoundError:
+        return set()
+
+def _process_file(item):
+    """Analyze one (path, mtime, thumb_hash, needs_thumbnail) item, creating the thumbnail if needed. Returns the DB upsert row."""
+    path, mtime, thumb_hash, needs_thumbnail = item
+    metadata = analyze_file_metadata(path)
+    if needs_thumbnail:
+        create_thumbnail(path, thumb_hash, metadata['type'])
+    return (file_id_for(path), path, os.path.dirname(path), mtime, thumb_hash, os.path.basename(path), *metadata.values())
+
+def process_files(items):
+    """Run _process_file over (path, mtime) pairs, spread across CPU cores for large batches.
+    Every file is independent; only the returned rows go back to the caller, which keeps
+    all SQLite writes in this process."""
+    existing_thumbs = existing_thumbnail_hashes()
+    prepared = []
+    for path, mtime in items:
+        thumb_hash = thumbnail_hash_for(path, mtime)
+        prepared.append((path, mtime, thumb_hash, thumb_hash not in existing_thumbs))
+    items = prepared
+    workers = analysis_process_count()
+    if len(items) >= PARALLEL_ANALYSIS_MIN_FILES and workers > 1:
+        try:
+            # 'spawn', not Linux's default fork: the sync runs while the server's other
+            # threads hold locks, and a forked child can inherit one held forever.
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_analysis_worker, initargs=(FFPROBE_EXECUTABLE_PATH,)) as ex:
+                return list(ex.map(_process_file, items, chunksize=8))
+        except Exception as e:
+            print(f"WARNING: Parallel file analysis failed ({e}), falling back to threads.")
+    if len(items) > 1:
+        # Small batches (and the fallback) still overlap the per-file mount reads: PIL,
+        # OpenCV and ffprobe all wait on I/O outside the GIL.
+        with ThreadPoolExecutor(max_workers=min(ANALYSIS_IO_THREADS, len(items))) as ex:
+            return list(ex.map(_process_file, items))
+    return [_process_file(item) for item in items]
+
+# One long-lived connection per thread instead of a connect/close per request.
+DB_BUSY_TIMEOUT_SEC = 10  # how long a writer waits for another thread's transaction
+_db_local = threading.local()
+
+class _ThreadConnection:
+    """Holds one thread's connection; the thread-local is its only reference. When the
+    thread ends (the dev server starts one per request) the holder is freed and closes
+    the connection right away: the connection itself sits in a reference cycle with its
+    statement cache and would otherwise stay open until a garbage collection."""
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __del__(self):
+        try: self.conn.close()
+        except Exception: pass
+
+_db_connections = weakref.WeakSet()  # holders still alive at exit, closed by the atexit hook
+
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_FILE)
+    holder = getattr(_db_local, 'holder', None)
+    if holder is not None:
+        return holder.conn
+    # check_same_thread=False only so the holder (or the atexit hook) can close it from
+    # another thread; each connection is still used by the thread that opened it.
+    # IMMEDIATE: the implicit BEGIN before a write takes the write lock up front, so two
+    # threads' read-then-write transactions wait on busy_timeout in turn instead of one
+    # failing with "database is locked" on the lock upgrade. Reads never open a transaction.
+    conn = sqlite3.connect(DATABASE_FILE, timeout=DB_BUSY_TIMEOUT_SEC, isolation_level='IMMEDIATE', check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-64000')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    holder = _db_local.holder = _ThreadConnection(conn)
+    _db_connections.add(holder)
     return conn
 
+# Writers take turns on this lock before SQLite's: a waiting thread wakes as soon as the
+# previous write commits instead of polling on the busy timeout.
+_db_write_lock = threading.Lock()
+db_generation = 0  # bumped after every committed db_write(); part of result-cache keys
+
+@contextlib.contextmanager
+def db_write(conn=None):
+    """Yield the thread's connection (or `conn`) for one write transaction, one writer
+    at a time. Commits on success, rolls back if the block raises. Keep slow disk/WAN
+    work outside the block."""
+    global db_generation
+    if conn is None:
+        conn = get_db_connection()
+    with _db_write_lock:
+        with conn:
+            yield conn
+        db_generation += 1
+
+@atexit.register
+def _close_db_connections():
+    for holder in list(_db_connections):
+        try: holder.conn.close()
+        except Exception: pass
+
+# Column order matches the rows built by _process_file. Shared by both syncs so the
+# statement is prepared once per connection (sqlite3 caches statements by SQL text).
+SQL_UPSERT_FILE = ("INSERT OR REPLACE INTO files (id, path, parent_dir, mtime, thumb_hash, name, type, duration, dimensions, has_workflow) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+def path_prefix_range(folder_path):
+    """(low, high) such that low <= path < high matches every path under folder_path.
+    Unlike LIKE 'folder/%' this uses the path index (LIKE is case-insensitive, the index
+    isn't) and doesn't read '_' or '%' in folder names as wildcards."""
+    return folder_path + os.sep, folder_path + chr(ord(os.sep) + 1)
+
 def init_db(conn=None):
-    close_conn = False
     if conn is None:
         conn = get_db_connection()
-        close_conn = True
     conn.execute('''
         CREATE TABLE IF NOT EXISTS files (
-            id TEXT PRIMARY KEY, path TEXT NOT NULL UNIQUE, mtime REAL NOT NULL,
+            id TEXT PRIMARY KEY, path TEXT NOT NULL UNIQUE, parent_dir TEXT NOT NULL, mtime REAL NOT NULL, thumb_hash TEXT NOT NULL,
             name TEXT NOT NULL, type TEXT, duration TEXT, dimensions TEXT,
             has_workflow INTEGER, is_favorite INTEGER DEFAULT 0
         )
     ''')
+    # gallery_view lists one folder (parent_dir) sorted by mtime, optionally favorites only;
+    # name filters are checked within that folder's range. Lookups by path use the UNIQUE
+    # constraint's index.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_parent_mtime ON files(parent_dir, mtime DESC)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_parent_favorite_mtime ON files(parent_dir, is_favorite, mtime DESC)')
+    # Superseded: the first duplicated the UNIQUE(path) index, the second made the favorites
+    # view scan every favorite in the library instead of the one folder, and no query used
+    # the third.
+    conn.execute('DROP INDEX IF EXISTS idx_files_path_mtime')
+    conn.execute('DROP INDEX IF EXISTS idx_files_favorite_mtime')
+    conn.execute('DROP INDEX IF EXISTS idx_files_name')
     conn.commit()
-    if close_conn: conn.close()
     
 def get_dynamic_folder_config(force_refresh=False):
     global folder_config_cache
-    if folder_config_cache is not None and not force_refresh:
-        return folder_config_cache
-
+    cached = folder_config_cache
+    if cached is not None and cached[0] is folder_config_version and not force_refresh:
+        return cached[1]
+    # Single-flight: concurrent cold requests wait for one directory walk instead of
+    # each walking the (possibly remote) tree themselves.
+    with folder_config_lock:
+        cached = folder_config_cache
+        if cached is not None and cached[0] is folder_config_version and not force_refresh:
+            return cached[1]
+        # Read the token before walking: an invalidation during the walk leaves this
+        # result stale and the next caller walks again.
+        version = folder_config_version
+        folder_config_cache = (version, _scan_folder_config())
+        return folder_config_cache[1]
+
+def invalidate_folder_config():
+    """Mark the folder tree stale after creating, renaming or deleting a folder. The next
+    reader rebuilds it once, however many mutations happened in between."""
+    global folder_config_version
+    folder_config_version = object()
+
+def _scan_folder_config():
     print("INFO: Refreshing folder configuration by scanning directory tree...")
 
     base_path_normalized = os.path.normpath(BASE_OUTPUT_PATH).replace('\\', '/')
@@ -504,7 +875,8 @@ def get_dynamic_folder_config(force_refresh=False):
     try:
         all_folders = {}
         for dirpath, dirnames, _ in os.walk(BASE_OUTPUT_PATH):
-            dirnames[:] = [d for d in dirnames if d not in [THUMBNAIL_CACHE_FOLDER_NAME, SQLITE_CACHE_FOLDER_NAME]]
+            dirnames[:] = [d for d in dirnames if d not in [THUMBNAIL_CACHE_FOLDER_NAME, SQLITE_CACHE_FOLDER_NAME]
+                           and not removal_pending(os.path.join(dirpath, d))]
             for dirname in dirnames:
                 full_path = os.path.normpath(os.path.join(dirpath, dirname)).replace('\\', '/')
                 relative_path = os.path.relpath(full_path, BASE_OUTPUT_PATH).replace('\\', '/')
@@ -545,104 +917,118 @@ def get_dynamic_folder_config(force_refresh=False):
             }
     except FileNotFoundError:
         print(f"WARNING: The base directory '{BASE_OUTPUT_PATH}' was not found.")
-    folder_config_cache = dynamic_config
+
+    # Keys from '_root_' down to each folder, for the breadcrumbs and the expanded tree.
+    # Parents sort before children above, so a parent's chain is always built first.
+    for key, info in dynamic_config.items():
+        parent = dynamic_config.get(info['parent']) if info['parent'] else None
+        info['ancestors'] = (parent['ancestors'] if parent and 'ancestors' in parent else []) + [key]
     return dynamic_config
     
 def full_sync_database(conn):
     print("INFO: Starting full file scan...")
     all_folders = get_dynamic_folder_config(force_refresh=True)
     start_time = time.time()
-    db_files = {row['path']: row['mtime'] for row in conn.execute('SELECT path, mtime FROM files').fetchall()}
+    db_files = {row['path']: row['mtime'] for row in conn.execute('SELECT path, mtime FROM files')}
     disk_files = {}
     for folder_data in all_folders.values():
         folder_path = folder_data['path']
         if not os.path.isdir(folder_path): continue
-        for name in os.listdir(folder_path):
-            filepath = os.path.join(folder_path, name)
-            if os.path.isfile(filepath) and os.path.splitext(name)[1].lower() not in ['.json', '.sqlite']:
-                disk_files[filepath] = os.path.getmtime(filepath)
+        with os.scandir(folder_path) as it:
+            for entry in it:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() not in ['.json', '.sqlite']:
+                    disk_files[os.path.join(folder_path, entry.name)] = entry.stat().st_mtime
     to_add = set(disk_files) - set(db_files)
     to_delete = set(db_files) - set(disk_files)
     to_check = set(disk_files) & set(db_files)
     to_update = {path for path in to_check if disk_files.get(path, 0) > db_files.get(path, 0)}
     files_to_process = to_add.union(to_update)
+    data_to_upsert = []
     if files_to_process:
         print(f"INFO: Analyzing {len(files_to_process)} new or modified files...")
-        data_to_upsert = []
-        for p in files_to_process:
-            metadata = analyze_file_metadata(p)
-            file_hash = hashlib.md5((p + str(disk_files[p])).encode()).hexdigest()
-            if not glob.glob(os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash}.*")):
-                create_thumbnail(p, file_hash, metadata['type'])
-            data_to_upsert.append((hashlib.md5(p.encode()).hexdigest(), p, disk_files[p], os.path.basename(p), *metadata.values()))
-        if data_to_upsert: conn.executemany("INSERT OR REPLACE INTO files (id, path, mtime, name, type, duration, dimensions, has_workflow) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", data_to_upsert)
+        data_to_upsert = process_files((p, disk_files[p]) for p in files_to_process)
     if to_delete:
         print(f"INFO: Removing {len(to_delete)} obsolete files...")
-        conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in to_delete])
-    conn.commit()
+    # Additions, updates and removals land in one transaction: one commit (one WAL sync).
+    if data_to_upsert or to_delete:
+        with db_write(conn):
+            if data_to_upsert: conn.executemany(SQL_UPSERT_FILE, data_to_upsert)
+            if to_delete: conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in to_delete])
     print(f"INFO: Full scan completed in {time.time() - start_time:.2f} seconds.")
 
 def sync_folder_on_demand(folder_path):
     print(f"INFO: Starting on-demand sync for folder: '{os.path.basename(folder_path)}'")
     try:
-        with get_db_connection() as conn:
-            disk_files, valid_extensions = {}, {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4', '.mkv', '.webm', '.mov', '.avi', '.mp3', '.wav', '.ogg', '.flac'}
-            for name in os.listdir(folder_path):
-                filepath = os.path.join(folder_path, name)
-                if os.path.isfile(filepath) and os.path.splitext(name)[1].lower() in valid_extensions:
-                    disk_files[filepath] = os.path.getmtime(filepath)
-            db_files_query = conn.execute("SELECT path, mtime FROM files WHERE path LIKE ?", (folder_path + os.sep + '%',)).fetchall()
-            db_files = {row['path']: row['mtime'] for row in db_files_query if os.path.normpath(os.path.dirname(row['path'])) == os.path.normpath(folder_path)}
-            disk_filepaths, db_filepaths = set(disk_files.keys()), set(db_files.keys())
-            files_to_add, files_to_delete = disk_filepaths - db_filepaths, db_filepaths - disk_filepaths
-            files_to_update = {path for path in (disk_filepaths & db_filepaths) if disk_files[path] > db_files[path]}
-            if files_to_add or files_to_update:
-                print(f"INFO: Found {len(files_to_add)} new and {len(files_to_update)} modified files. Processing...")
-                data_to_upsert = []
-                for path in files_to_add.union(files_to_update):
-                    mtime = disk_files[path]
-                    metadata = analyze_file_metadata(path)
-                    file_hash = hashlib.md5((path + str(mtime)).encode()).hexdigest()
-                    if not glob.glob(os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash}.*")): create_thumbnail(path, file_hash, metadata['type'])
-                    data_to_upsert.append((hashlib.md5(path.encode()).hexdigest(), path, mtime, os.path.basename(path), *metadata.values()))
-                if data_to_upsert: conn.executemany("INSERT OR REPLACE INTO files (id, path, mtime, name, type, duration, dimensions, has_workflow) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", data_to_upsert)
-            if files_to_delete:
-                print(f"INFO: Found {len(files_to_delete)} deleted files. Removing from database...")
-                paths_to_delete_list = list(files_to_delete)
-                placeholders = ','.join('?' * len(paths_to_delete_list))
-                conn.execute(f"DELETE FROM files WHERE path IN ({placeholders})", paths_to_delete_list)
-            if files_to_add or files_to_update or files_to_delete:
-                conn.commit()
+        conn = get_db_connection()
+        disk_files, valid_extensions = {}, {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4', '.mkv', '.webm', '.mov', '.avi', '.mp3', '.wav', '.ogg', '.flac'}
+        with os.scandir(folder_path) as it:
+            for entry in it:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in valid_extensions:
+                    disk_files[os.path.join(folder_path, entry.name)] = entry.stat().st_mtime
+        db_files = {row['path']: row['mtime'] for row in conn.execute("SELECT path, mtime FROM files WHERE parent_dir = ?", (folder_path,))}
+        disk_filepaths, db_filepaths = set(disk_files.keys()), set(db_files.keys())
+        files_to_add, files_to_delete = disk_filepaths - db_filepaths, db_filepaths - disk_filepaths
+        files_to_update = {path for path in (disk_filepaths & db_filepaths) if disk_files[path] > db_files[path]}
+        data_to_upsert = []
+        if files_to_add or files_to_update:
+            print(f"INFO: Found {len(files_to_add)} new and {len(files_to_update)} modified files. Processing...")
+            data_to_upsert = process_files((path, disk_files[path]) for path in files_to_add.union(files_to_update))
+        if files_to_delete:
+            print(f"INFO: Found {len(files_to_delete)} deleted files. Removing from database...")
+        if data_to_upsert or files_to_delete:
+            with db_write(conn):
+                if data_to_upsert: conn.executemany(SQL_UPSERT_FILE, data_to_upsert)
+                if files_to_delete:
+                    paths_to_delete_list = list(files_to_delete)
+                    placeholders = ','.join('?' * len(paths_to_delete_list))
+                    conn.execute(f"DELETE FROM files WHERE path IN ({placeholders})", paths_to_delete_list)
     except Exception as e:
         print(f"ERROR: An error occurred during on-demand sync of folder '{folder_path}': {e}")
 
-def scan_folder_and_extract_options(folder_path):
+def folder_filter_options(folder_path):
+    """Extensions and name prefixes offered as filters for one folder, from the index.
+    Listing the folder itself on every view would go to the WAN mount; the index holds
+    exactly the files the filters apply to."""
     extensions, prefixes = set(), set()
     try:
-        if not os.path.isdir(folder_path): return None, [], []
-        for filename in os.listdir(folder_path):
-            if os.path.isfile(os.path.join(folder_path, filename)):
+        with get_db_connection() as conn:
+            for (filename,) in conn.execute("SELECT name FROM files WHERE parent_dir = ?", (folder_path,)):
                 ext = os.path.splitext(filename)[1]
                 if ext and ext.lower() not in ['.json', '.sqlite']: extensions.add(ext.lstrip('.').lower())
                 if '_' in filename: prefixes.add(filename.split('_')[0])
-    except Exception as e: print(f"ERROR: Could not scan folder '{folder_path}': {e}")
-    return None, sorted(list(extensions)), sorted(list(prefixes))
+    except Exception as e: print(f"ERROR: Could not read filter options for '{folder_path}': {e}")
+    return sorted(extensions), sorted(prefixes)
 
 def get_all_prefixes():
     """Get all unique prefixes from all files in the gallery database."""
-    prefixes = set()
+    # Runs on every gallery_view, so SQLite extracts and de-duplicates the prefixes
+    # instead of handing every file name in the library to Python. instr > 1 skips names
+    # without '_' and names starting with it (empty prefix).
     try:
         with get_db_connection() as conn:
-            files = conn.execute("SELECT name FROM files").fetchall()
-            for row in files:
-                filename = row['name']
-                if '_' in filename:
-                    prefix = filename.split('_')[0]
-                    if prefix:  # Only add non-empty prefixes
-                        prefixes.add(prefix)
+            return [row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(name, 1, instr(name, '_') - 1) AS prefix FROM files "
+                "WHERE instr(name, '_') > 1 ORDER BY prefix")]
     except Exception as e:
         print(f"ERROR: Could not get all prefixes: {e}")
-    return sorted(list(prefixes))
+    return []
+
+def sweep_stale_thumbnails(conn):
+    """Delete cached thumbnails no indexed file uses: older formats (.jpeg/.gif) and
+    hashes from an earlier schema. Run after a rebuild, once the sync has made the
+    current ones, so the cache doesn't keep both generations."""
+    live_hashes = {row[0] for row in conn.execute("SELECT thumb_hash FROM files")}
+    removed = 0
+    try:
+        with os.scandir(THUMBNAIL_CACHE_DIR) as it:
+            for entry in it:
+                file_hash, ext = os.path.splitext(entry.name)
+                if ext == THUMBNAIL_EXT and file_hash in live_hashes: continue
+                try:
+                    if entry.is_file(): os.remove(entry.path); removed += 1
+                except OSError: pass
+    except OSError: return
+    if removed: print(f"INFO: Removed {removed} stale thumbnails.")
 
 def initialize_gallery():
     print("INFO: Initializing gallery...")
@@ -652,18 +1038,27 @@ def initialize_gallery():
     os.makedirs(SQLITE_CACHE_DIR, exist_ok=True)
     with get_db_connection() as conn:
         try:
+            # WAL is persistent in the database file: readers no longer block the writer.
+            conn.execute('PRAGMA journal_mode=WAL')
             stored_version = conn.execute('PRAGMA user_version').fetchone()[0]
         except sqlite3.DatabaseError: stored_version = 0
         if stored_version < DB_SCHEMA_VERSION:
             print(f"INFO: DB version outdated ({stored_version} < {DB_SCHEMA_VERSION}). Rebuilding database...")
+            # Favorites exist only in the database; carry them across the rebuild by path.
+            try: favorite_paths = [(row[0],) for row in conn.execute("SELECT path FROM files WHERE is_favorite = 1")]
+            except sqlite3.Error: favorite_paths = []
             conn.execute('DROP TABLE IF EXISTS files')
             init_db(conn)
             full_sync_database(conn)
+            if favorite_paths:
+                with db_write(conn): conn.executemany("UPDATE files SET is_favorite = 1 WHERE path = ?", favorite_paths)
+            sweep_stale_thumbnails(conn)
             conn.execute(f'PRAGMA user_version = {DB_SCHEMA_VERSION}')
             conn.commit()
             print("INFO: Rebuild complete.")
         else:
             print(f"INFO: DB version ({stored_version}) is up to date. Starting normally.")
+            init_db(conn)  # creates any index added since the database was built
 
 
 # --- FLASK ROUTES ---
@@ -690,7 +1085,7 @@ def refresh_mount_dir(relative_path=''):
         try:
             req = urllib.request.Request(
                 f"{RCLONE_RC_URL}/{cmd}",
-                data=json.dumps(params).encode(),
+                data=orjson.dumps(params),
                 headers={'Content-Type': 'application/json'},
                 method='POST',
             )
@@ -719,9 +1114,62 @@ def refresh_fs(folder_key):
         sync_folder_on_demand(folders[folder_key]['path'])
     return jsonify({'ok': True, 'folder': folder_key})
 
+def build_file_query(folder_path, args):
+    """Turn the gallery filter query string into (where_sql, params, sort_order) for one folder."""
+    conditions, params = ["parent_dir = ?"], [folder_path]
+
+    # MODIFICATION 1: Get sort_order parameter from URL, defaulting to 'desc'
+    sort_order = args.get('sort_order', 'desc').lower()
+    if sort_order not in ['asc', 'desc']:
+        sort_order = 'desc' # Ensure only valid values are used
+
+    search_term = args.get('search', '').strip()
+    if search_term:
+        conditions.append("name LIKE ?")
+        params.append(f"%{search_term}%")
+    if args.get('favorites', 'false').lower() == 'true':
+        conditions.append("is_favorite = 1")
+
+    selected_prefixes = args.getlist('prefix')
+    if selected_prefixes:
+        prefix_conditions = []
+        for prefix in selected_prefixes:
+            prefix_clean = prefix.strip()
+            if prefix_clean:
+                prefix_conditions.append("name LIKE ?")
+                params.append(f"{prefix_clean}_%")
+        if prefix_conditions:
+            conditions.append(f"({' OR '.join(prefix_conditions)})")
+
+    selected_extensions = args.getlist('extension')
+    if selected_extensions:
+        ext_conditions = []
+        for ext in selected_extensions:
+            ext_clean = ext.lstrip('.').lower()
+            ext_conditions.append("name LIKE ?")
+            params.append(f"%.{ext_clean}")
+        conditions.append(f"({' OR '.join(ext_conditions)})")
+    return ' AND '.join(conditions), params, sort_order
+
+# What the gallery page reads for each file; the server-side path and folder stay private.
+FILE_PAGE_COLUMNS = 'id, name, type, duration, dimensions, has_workflow, is_favorite, thumb_hash'
+
+def fetch_file_page(conn, where_sql, params, sort_order, offset=0):
+    """One PAGE_SIZE slice of the filtered listing, as dicts."""
+    # MODIFICATION 2: Build the query with dynamic sorting direction (id breaks mtime ties
+    # so consecutive pages never overlap or skip a row).
+    sort_direction = "ASC" if sort_order == 'asc' else "DESC"
+    query = f"SELECT {FILE_PAGE_COLUMNS} FROM files WHERE {where_sql} ORDER BY mtime {sort_direction}, id {sort_direction} LIMIT ? OFFSET ?"
+    return [dict(row) for row in conn.execute(query, [*params, PAGE_SIZE, offset])]
+
+@functools.lru_cache(maxsize=64)
+def serialized_file_page(where_sql, params, sort_order, offset, generation):
+    """fetch_file_page() as ready-to-send JSON bytes. Repeat scrolls over the same listing
+    reuse the encoded page; `generation` (db_generation) drops it after any write."""
+    return orjson.dumps({'files': fetch_file_page(get_db_connection(), where_sql, params, sort_order, offset)})
+
 @app.route('/galleryout/view/<string:folder_key>')
 def gallery_view(folder_key):
-    global gallery_view_cache
     # Normal loads (incl. F5, paging, sort, filter) serve from the cached folder tree +
     # SQLite index ONLY — no WAN walk, no rclone re-list. Forcing a full os.walk + an
     # on-demand sync on every request hammered the WAN mount and stacked up concurrent
@@ -733,63 +1181,16 @@ def gallery_view(folder_key):
         return redirect(url_for('gallery_view', folder_key='_root_'))
     current_folder_info = folders[folder_key]
     folder_path = current_folder_info['path']
+    where_sql, params, sort_order = build_file_query(folder_path, request.args)
+    # Only the first page is read; load_more fetches later pages with the same filters.
     with get_db_connection() as conn:
-        conditions, params = [], []
-        conditions.append("path LIKE ?")
-        params.append(folder_path + os.sep + '%')
-        
-        # MODIFICATION 1: Get sort_order parameter from URL, defaulting to 'desc'
-        sort_order = request.args.get('sort_order', 'desc').lower()
-        if sort_order not in ['asc', 'desc']:
-            sort_order = 'desc' # Ensure only valid values are used
-
-        search_term = request.args.get('search', '').strip()
-        if search_term:
-            conditions.append("name LIKE ?")
-            params.append(f"%{search_term}%")
-        if request.args.get('favorites', 'false').lower() == 'true':
-            conditions.append("is_favorite = 1")
-
-        selected_prefixes = request.args.getlist('prefix')
-        if selected_prefixes:
-            prefix_conditions = []
-            for prefix in selected_prefixes:
-                prefix_clean = prefix.strip()
-                if prefix_clean:
-                    prefix_conditions.append("name LIKE ?")
-                    params.append(f"{prefix_clean}_%")
-            if prefix_conditions:
-                conditions.append(f"({' OR '.join(prefix_conditions)})")
-
-        selected_extensions = request.args.getlist('extension')
-        if selected_extensions:
-            ext_conditions = []
-            for ext in selected_extensions:
-                ext_clean = ext.lstrip('.').lower()
-                ext_conditions.append("name LIKE ?")
-                params.append(f"%.{ext_clean}")
-            conditions.append(f"({' OR '.join(ext_conditions)})")
-        
-        # MODIFICATION 2: Build the query with dynamic sorting direction
-        sort_direction = "ASC" if sort_order == 'asc' else "DESC"
-        query = f"SELECT * FROM files WHERE {' AND '.join(conditions)} ORDER BY mtime {sort_direction}"
-        
-        all_files_raw = conn.execute(query, params).fetchall()
-        
-    folder_path_norm = os.path.normpath(folder_path)
-    all_files_filtered = [dict(row) for row in all_files_raw if os.path.normpath(os.path.dirname(row['path'])) == folder_path_norm]
-    gallery_view_cache = all_files_filtered
-    initial_files = gallery_view_cache[:PAGE_SIZE]
-    _, extensions, prefixes = scan_folder_and_extract_options(folder_path)
+        total_files = conn.execute(f"SELECT COUNT(*) FROM files WHERE {where_sql}", params).fetchone()[0]
+        initial_files = fetch_file_page(conn, where_sql, params, sort_order)
+
+    extensions, prefixes = folder_filter_options(folder_path)
     all_prefixes = get_all_prefixes()  # Get all prefixes for sidebar
-    breadcrumbs, ancestor_keys = [], set()
-    curr_key = folder_key
-    while curr_key is not None and curr_key in folders:
-        folder_info = folders[curr_key]
-        breadcrumbs.append({'key': curr_key, 'display_name': folder_info['display_name']})
-        ancestor_keys.add(curr_key)
-        curr_key = folder_info.get('parent')
-    breadcrumbs.reverse()
+    ancestor_keys = current_folder_info['ancestors']
+    breadcrumbs = [{'key': key, 'display_name': folders[key]['display_name']} for key in ancestor_keys]
     
     # Check deletion permissions for the current client
     client_ip = get_client_ip()
@@ -797,12 +1198,12 @@ def gallery_view(folder_key):
     
     return render_template('index.html', 
                            files=initial_files, 
-                           total_files=len(gallery_view_cache), 
+                           total_files=total_files, 
                            folders=folders,
                            current_folder_key=folder_key, 
                            current_folder_info=current_folder_info,
                            breadcrumbs=breadcrumbs,
-                           ancestor_keys=list(ancestor_keys),
+                           ancestor_keys=ancestor_keys,
                            available_extensions=extensions, 
                            available_prefixes=prefixes,
                            all_prefixes=all_prefixes,  # All prefixes for sidebar
@@ -826,16 +1227,17 @@ def create_folder():
     
     data = request.json
     parent_key = data.get('parent_key', '_root_')
-    folder_name = re.sub(r'[^a-zA-Z0-9_-]', '', data.get('folder_name', '')).strip()
+    folder_name = safe_folder_name(data.get('folder_name', ''))
     if not folder_name: return jsonify({'status': 'error', 'message': 'Invalid folder name provided.'}), 400
     folders = get_dynamic_folder_config()
     if parent_key not in folders: return jsonify({'status': 'error', 'message': 'Parent folder not found.'}), 404
     parent_path = folders[parent_key]['path']
     new_folder_path = os.path.join(parent_path, folder_name)
+    if removal_pending(new_folder_path): return jsonify({'status': 'error', 'message': 'A folder with this name is still being deleted. Try again shortly.'}), 409
     if os.path.exists(new_folder_path): return jsonify({'status': 'error', 'message': 'A folder with this name already exists here.'}), 400
     try:
         os.makedirs(new_folder_path)
-        get_dynamic_folder_config(force_refresh=True)
+        invalidate_folder_config()
         return jsonify({'status': 'success', 'message': 'Folder created successfully.'})
     except Exception as e: return jsonify({'status': 'error', 'message': f'Error creating folder: {e}'}), 500
 
@@ -864,26 +1266,25 @@ def rename_folder(folder_key):
         return jsonify({'status': 'error', 'message': f'Folder rename not permitted: {reason}'}), 403
     
     if folder_key in PROTECTED_FOLDER_KEYS: return jsonify({'status': 'error', 'message': 'This folder cannot be renamed.'}), 403
-    new_name = re.sub(r'[^a-zA-Z0-9_-]', '', request.json.get('new_name', '')).strip()
+    new_name = safe_folder_name(request.json.get('new_name', ''))
     if not new_name: return jsonify({'status': 'error', 'message': 'Invalid name.'}), 400
     folders = get_dynamic_folder_config()
     if folder_key not in folders: return jsonify({'status': 'error', 'message': 'Folder not found.'}), 400
     old_path = folders[folder_key]['path']
     new_path = os.path.join(os.path.dirname(old_path), new_name)
+    if removal_pending(new_path): return jsonify({'status': 'error', 'message': 'A folder with this name is still being deleted. Try again shortly.'}), 409
     if os.path.exists(new_path): return jsonify({'status': 'error', 'message': 'A folder with this name already exists.'}), 400
     try:
-        with get_db_connection() as conn:
-            old_path_like = old_path + os.sep + '%'
-            files_to_update = conn.execute("SELECT id, path FROM files WHERE path LIKE ?", (old_path_like,)).fetchall()
-            update_data = []
-            for row in files_to_update:
-                new_file_path = row['path'].replace(old_path, new_path, 1)
-                new_id = hashlib.md5(new_file_path.encode()).hexdigest()
-                update_data.append((new_id, new_file_path, row['id']))
-            os.rename(old_path, new_path)
-            if update_data: conn.executemany("UPDATE files SET id = ?, path = ? WHERE id = ?", update_data)
-            conn.commit()
-        get_dynamic_folder_config(force_refresh=True)
+        files_to_update = get_db_connection().execute("SELECT id, path FROM files WHERE path >= ? AND path < ?", path_prefix_range(old_path)).fetchall()
+        update_data = []
+        for row in files_to_update:
+            new_file_path = row['path'].replace(old_path, new_path, 1)
+            new_id = file_id_for(new_file_path)
+            update_data.append((new_id, new_file_path, os.path.dirname(new_file_path), row['id']))
+        move_path(old_path, new_path)
+        if update_data:
+            with db_write() as conn: conn.executemany("UPDATE files SET id = ?, path = ?, parent_dir = ? WHERE id = ?", update_data)
+        invalidate_folder_config()
         return jsonify({'status': 'success', 'message': 'Folder renamed.'})
     except Exception as e: return jsonify({'status': 'error', 'message': f'Error: {e}'}), 500
 
@@ -900,25 +1301,46 @@ def delete_folder(folder_key):
     if folder_key not in folders: return jsonify({'status': 'error', 'message': 'Folder not found.'}), 404
     try:
         folder_path = folders[folder_key]['path']
-        with get_db_connection() as conn:
-            conn.execute("DELETE FROM files WHERE path LIKE ?", (folder_path + os.sep + '%',))
-            conn.commit()
-        shutil.rmtree(folder_path)
-        get_dynamic_folder_config(force_refresh=True)
+        with db_write() as conn:
+            conn.execute("DELETE FROM files WHERE path >= ? AND path < ?", path_prefix_range(folder_path))
+        remove_tree_in_background(folder_path)
+        invalidate_folder_config()
         return jsonify({'status': 'success', 'message': 'Folder deleted.'})
     except Exception as e: return jsonify({'status': 'error', 'message': f'Error: {e}'}), 500
 
 @app.route('/galleryout/load_more')
 def load_more():
-    offset = request.args.get('offset', 0, type=int)
-    if offset >= len(gallery_view_cache): return jsonify(files=[])
-    return jsonify(files=gallery_view_cache[offset:offset + PAGE_SIZE])
-
-def get_file_info_from_db(file_id, column='*'):
+    folders = get_dynamic_folder_config()
+    folder_key = request.args.get('folder_key', '_root_')
+    if folder_key not in folders: return jsonify(files=[])
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    where_sql, params, sort_order = build_file_query(folders[folder_key]['path'], request.args)
+    return Response(serialized_file_page(where_sql, tuple(params), sort_order, offset, db_generation), mimetype='application/json')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def send_versioned_file(path, version, **kwargs):
+    """send_file(), cacheable by the browser for a year when the URL carries ?v=<version>
+    matching the file's current thumb_hash: that URL can never serve other content, since
+    the hash changes with the file's mtime. Other requests keep the default revalidation."""
+    if request.args.get('v') != version:
+        return send_file(path, **kwargs)
+    response = send_file(path, max_age=IMMUTABLE_MAX_AGE, **kwargs)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# What the file routes need from a row.
+FILE_INFO_COLUMNS = 'path, mtime, type, thumb_hash'
+
+def get_file_info_from_db(file_id, column=None):
+    """The row's FILE_INFO_COLUMNS as a dict, or just the value of `column`. 404 if unknown."""
     with get_db_connection() as conn:
-        row = conn.execute(f"SELECT {column} FROM files WHERE id = ?", (file_id,)).fetchone()
+        row = conn.execute(f"SELECT {column or FILE_INFO_COLUMNS} FROM files WHERE id = ?", (file_id,)).fetchone()
     if not row: abort(404)
-    return dict(row) if column == '*' else row[0]
+    return row[0] if column else dict(row)
+
+MOVE_IO_THREADS = 8
 
 @app.route('/galleryout/move_batch', methods=['POST'])
 def move_batch():
@@ -926,23 +1348,37 @@ def move_batch():
     file_ids, dest_key = data.get('file_ids', []), data.get('destination_folder')
     folders = get_dynamic_folder_config()
     if not all([file_ids, dest_key, dest_key in folders]): return jsonify({'status': 'error', 'message': 'Invalid data.'}), 400
-    failed_moves, moved_count = [], 0
+    failed_moves = []
     dest_path_folder = folders[dest_key]['path']
-    with get_db_connection() as conn:
-        for file_id in file_ids:
-            try:
-                source_path = conn.execute("SELECT path FROM files WHERE id = ?", (file_id,)).fetchone()['path']
-                source_filename = os.path.basename(source_path)
-                dest_path_file = os.path.join(dest_path_folder, source_filename)
-                if os.path.exists(dest_path_file):
-                    failed_moves.append(source_filename)
-                    continue
-                shutil.move(source_path, dest_path_file)
-                new_id = hashlib.md5(dest_path_file.encode()).hexdigest()
-                conn.execute("UPDATE files SET id = ?, path = ? WHERE id = ?", (new_id, dest_path_file, file_id))
-                moved_count += 1
-            except Exception: continue
-        conn.commit()
+    placeholders = ','.join('?' * len(file_ids))
+    rows = get_db_connection().execute(f"SELECT id, path FROM files WHERE id IN ({placeholders})", file_ids).fetchall()
+    planned, planned_names = [], set()
+    for row in rows:
+        source_filename = os.path.basename(row['path'])
+        dest_path_file = os.path.join(dest_path_folder, source_filename)
+        # Two selected files with the same name would race for one destination.
+        if source_filename in planned_names or os.path.exists(dest_path_file):
+            failed_moves.append(source_filename)
+            continue
+        planned_names.add(source_filename)
+        planned.append((row['id'], row['path'], dest_path_file))
+
+    def move_one(item):
+        file_id, source_path, dest_path_file = item
+        try:
+            move_path(source_path, dest_path_file)
+            return (file_id_for(dest_path_file), dest_path_file, dest_path_folder, file_id)
+        except Exception: return None
+
+    # On a network mount each rename is a server round trip (a copy on object storage),
+    # so overlap them; the DB is still updated once, after all of them.
+    update_data = []
+    if planned:
+        with ThreadPoolExecutor(max_workers=min(MOVE_IO_THREADS, len(planned))) as ex:
+            update_data = [update for update in ex.map(move_one, planned) if update]
+    moved_count = len(update_data)
+    if update_data:
+        with db_write() as conn: conn.executemany("UPDATE files SET id = ?, path = ?, parent_dir = ? WHERE id = ?", update_data)
     if failed_moves:
         message = f"Moved {moved_count} files. Failed to move {len(failed_moves)} (already exist)."
         return jsonify({'status': 'partial_success', 'message': message})
@@ -959,20 +1395,18 @@ def delete_batch():
     file_ids = request.json.get('file_ids', [])
     if not file_ids: return jsonify({'status': 'error', 'message': 'No files selected.'}), 400
     deleted_count = 0
-    with get_db_connection() as conn:
-        placeholders = ','.join('?' * len(file_ids))
-        files_to_delete = conn.execute(f"SELECT id, path FROM files WHERE id IN ({placeholders})", file_ids).fetchall()
-        ids_to_remove_from_db = []
-        for row in files_to_delete:
-            try:
-                os.remove(row['path'])
-                ids_to_remove_from_db.append(row['id'])
-                deleted_count += 1
-            except Exception: continue
-        if ids_to_remove_from_db:
-            db_placeholders = ','.join('?' * len(ids_to_remove_from_db))
-            conn.execute(f"DELETE FROM files WHERE id IN ({db_placeholders})", ids_to_remove_from_db)
-            conn.commit()
+    placeholders = ','.join('?' * len(file_ids))
+    files_to_delete = get_db_connection().execute(f"SELECT id, path FROM files WHERE id IN ({placeholders})", file_ids).fetchall()
+    ids_to_remove_from_db = []
+    for row in files_to_delete:
+        try:
+            os.remove(row['path'])
+            ids_to_remove_from_db.append(row['id'])
+            deleted_count += 1
+        except Exception: continue
+    if ids_to_remove_from_db:
+        db_placeholders = ','.join('?' * len(ids_to_remove_from_db))
+        with db_write() as conn: conn.execute(f"DELETE FROM files WHERE id IN ({db_placeholders})", ids_to_remove_from_db)
     return jsonify({'status': 'success', 'message': f'Successfully deleted {deleted_count} files.'})
 
 @app.route('/galleryout/favorite_batch', methods=['POST'])
@@ -980,27 +1414,26 @@ def favorite_batch():
     data = request.json
     file_ids, status = data.get('file_ids', []), data.get('status', False)
     if not file_ids: return jsonify({'status': 'error', 'message': 'No files selected'}), 400
-    with get_db_connection() as conn:
+    with db_write() as conn:
         placeholders = ','.join('?' * len(file_ids))
         conn.execute(f"UPDATE files SET is_favorite = ? WHERE id IN ({placeholders})", [1 if status else 0] + file_ids)
-        conn.commit()
     return jsonify({'status': 'success'})
 
 @app.route('/galleryout/toggle_favorite/<string:file_id>', methods=['POST'])
 def toggle_favorite(file_id):
-    with get_db_connection() as conn:
+    with db_write() as conn:
         current = conn.execute("SELECT is_favorite FROM files WHERE id = ?", (file_id,)).fetchone()
         if not current: abort(404)
         new_status = 1 - current['is_favorite']
         conn.execute("UPDATE files SET is_favorite = ? WHERE id = ?", (new_status, file_id))
-        conn.commit()
         return jsonify({'status': 'success', 'is_favorite': bool(new_status)})
 
 @app.route('/galleryout/file/<string:file_id>')
 def serve_file(file_id):
-    filepath = get_file_info_from_db(file_id, 'path')
-    if filepath.lower().endswith('.webp'): return send_file(filepath, mimetype='image/webp')
-    return send_file(filepath)
+    info = get_file_info_from_db(file_id)
+    filepath = info['path']
+    if filepath.lower().endswith('.webp'): return send_versioned_file(filepath, info['thumb_hash'], mimetype='image/webp')
+    return send_versioned_file(filepath, info['thumb_hash'])
 
 @app.route('/galleryout/download/<string:file_id>')
 def download_file(file_id):
@@ -1009,8 +1442,8 @@ def download_file(file_id):
 
 @app.route('/galleryout/workflow/<string:file_id>')
 def download_workflow(file_id):
-    filepath = get_file_info_from_db(file_id, 'path')
-    workflow_json = extract_workflow(filepath)
+    info = get_file_info_from_db(file_id)
+    workflow_json = extract_workflow_cached(info['path'], info['mtime'])
     if workflow_json: return Response(workflow_json, mimetype='application/json', headers={'Content-Disposition': 'attachment;filename=workflow.json'})
     abort(404)
 
@@ -1025,19 +1458,17 @@ def delete_file(file_id):
     try:
         filepath = get_file_info_from_db(file_id, 'path')
         os.remove(filepath)
-        with get_db_connection() as conn:
-            conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
-            conn.commit()
+        with db_write() as conn: conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
         return jsonify({'status': 'success'})
     except Exception:
-        with get_db_connection() as conn: conn.execute("DELETE FROM files WHERE id = ?", (file_id,)); conn.commit()
+        with db_write() as conn: conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
         return jsonify({'status': 'error', 'message': 'File not on disk, but removed from DB.'})
 
 @app.route('/galleryout/node_summary/<string:file_id>')
 def get_node_summary(file_id):
     try:
-        filepath = get_file_info_from_db(file_id, 'path')
-        workflow_json = extract_workflow(filepath)
+        info = get_file_info_from_db(file_id)
+        workflow_json = extract_workflow_cached(info['path'], info['mtime'])
 
         if not workflow_json:
             return jsonify({'status': 'error', 'message': 'Workflow not found for this file.'}), 404
@@ -1056,13 +1487,14 @@ def get_node_summary(file_id):
 @app.route('/galleryout/thumbnail/<string:file_id>')
 def serve_thumbnail(file_id):
     info = get_file_info_from_db(file_id)
-    filepath, mtime = info['path'], info['mtime']
-    file_hash = hashlib.md5((filepath + str(mtime)).encode()).hexdigest()
-    existing_thumbnails = glob.glob(os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash}.*"))
-    if existing_thumbnails: return send_file(existing_thumbnails[0])
+    # thumb_hash is stored when the file is indexed and kept across moves and renames
+    # (same content, same mtime), so a moved file keeps its cached thumbnail.
+    filepath, file_hash = info['path'], info['thumb_hash']
+    cache_path = thumbnail_path_for(file_hash)
+    if os.path.exists(cache_path): return send_versioned_file(cache_path, file_hash)
     print(f"WARN: Thumbnail not found for {os.path.basename(filepath)}, generating...")
     cache_path = create_thumbnail(filepath, file_hash, info['type'])
-    if cache_path and os.path.exists(cache_path): return send_file(cache_path)
+    if cache_path and os.path.exists(cache_path): return send_versioned_file(cache_path, file_hash)
     return "Thumbnail generation failed", 404
 
 if __name__ == '__main__':
@@ -26,8 +26,8 @@ from smartgallery import (
 
 def _wait_for_mount(path, timeout=180):
     """Block until ``path`` looks mounted/populated, or timeout elapses."""
-    deadline = time.time() + timeout
-    while time.time() < deadline:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
         try:
             if os.path.ismount(path) or (os.path.isdir(path) and os.listdir(path)):
                 return True